@@ -1,57 +1,182 @@
 #!/usr/bin/env python3
 
 from abc import ABC, abstractmethod
+import collections
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import functools
 import threading
 import time
+import weakref
 from typing import Optional
 
+from flask import Response
+import orjson
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .rwlock import RWLock
+
 TICK_PRICE_MULTIPLIER = 0.1
+PROCESSED_ORDER_EXPIRATION = 10  # seconds
+EMPTY_BODY = b'{}'
+# Fits within every DEX session's connection pool, so concurrent closes never wait on a socket
+CLOSE_POSITIONS_MAX_WORKERS = 16
+
+ProcessedOrder = collections.namedtuple(
+    'ProcessedOrder', ['timestamp', 'filled_size', 'filled_value', 'filled_fee'])
+
+
+def json_response(body: bytes, status=200):
+    return Response(body, status=status, mimetype='application/json')
+
+
+def fast_jsonify(payload, status=200):
+    return json_response(orjson.dumps(payload), status)
+
+
+def step_decimals(step_size: str):
+    # Decimals of a tick or lot size string, e.g. '0.25' -> 2, '0.0010' -> 3
+    return len(step_size.partition('.')[2].rstrip('0'))
+
+
+def pooled_adapter(pool_connections, pool_maxsize, retries, backoff_factor):
+    # Retry only covers idempotent methods by default, so order POSTs are never resent
+    return HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                       max_retries=Retry(total=retries, backoff_factor=backoff_factor))
+
+
+@functools.lru_cache(maxsize=256)
+def strip_hyphen(symbol: str):
+    return symbol.replace("-", "")
 
 
 class AbstractDex(ABC):
+    # One cleanup thread is shared by every DEX instance in the process
+    _instances = weakref.WeakSet()
+    _cleanup_thread = None
+    _cleanup_stop = None
+    _cleanup_thread_lock = threading.Lock()
 
     def __init__(self):
-        self.price_info = {}
-        self.processed_orders = {}  # {'symbol': {'order_id': timestamp, ...}, ...}
-        self.websocket_lock = threading.Lock()
-        self.cleanup_timer_thread = None
-        self.__schedule_cleanup()
+        # {(symbol, order_id): (inserted_at, ProcessedOrder), ...} in insertion order
+        self.processed_orders = collections.OrderedDict()
+        self._orders_by_symbol = collections.defaultdict(dict)  # {'symbol': {'order_id': None, ...}, ...}
+        self.websocket_lock = RWLock()
+        self.__register_cleanup()
 
     def cleanup_timer(self):
-        if self.cleanup_timer_thread:
-            self.cleanup_timer_thread.cancel()
-
-    def __cleanup_processed_orders(self, expiration_time):
-        current_timestamp = time.time()
-        with self.websocket_lock:
-            for symbol in list(self.processed_orders.keys()):
-                for order_id in list(self.processed_orders[symbol].keys()):
-                    if current_timestamp - self.processed_orders[symbol][order_id]["timestamp"] > expiration_time:
-                        del self.processed_orders[symbol][order_id]
-                if not self.processed_orders[symbol]:
-                    del self.processed_orders[symbol]
-
-    def __schedule_cleanup(self, expiration_time=10):
-        self.__cleanup_processed_orders(expiration_time)
-        self.cleanup_timer_thread = threading.Timer(
-            expiration_time, self.__schedule_cleanup)
-        self.cleanup_timer_thread.start()
-
-    def modify_price_for_instant_fill(self, symbol: str, side: str, price: str):
+        with AbstractDex._cleanup_thread_lock:
+            AbstractDex._instances.discard(self)
+            if not AbstractDex._instances and AbstractDex._cleanup_thread is not None:
+                AbstractDex._cleanup_stop.set()
+                AbstractDex._cleanup_thread = None
+
+    def _add_processed_order(self, symbol: str, order_id: str, record: ProcessedOrder):
+        # The caller must hold the websocket_lock write lock
+        key = (symbol, order_id)
+        if key in self.processed_orders:
+            return
+        # TTL math uses the monotonic clock; record.timestamp stays wall clock for clients
+        self.processed_orders[key] = (time.monotonic(), record)
+        self._orders_by_symbol[symbol][order_id] = None
+
+    def __remove_processed_order(self, key):
+        # The caller must hold the websocket_lock write lock
+        del self.processed_orders[key]
+        symbol, order_id = key
+        order_ids = self._orders_by_symbol[symbol]
+        del order_ids[order_id]
+        if not order_ids:
+            del self._orders_by_symbol[symbol]
+
+    def _expire_processed_orders(self, current_timestamp):
+        # The caller must hold the websocket_lock write lock
+        # Entries are inserted in time order and share one TTL, so evict from the front
+        cutoff = current_timestamp - PROCESSED_ORDER_EXPIRATION
+        while self.processed_orders:
+            key, (inserted_at, _) = next(iter(self.processed_orders.items()))
+            if inserted_at > cutoff:
+                break
+            self.__remove_processed_order(key)
+
+    def _live_processed_orders(self, symbol: str):
+        # The caller must hold the websocket_lock read lock
+        # Hide entries that are due but have not been swept yet
+        cutoff = time.monotonic() - PROCESSED_ORDER_EXPIRATION
+        order_ids = self._orders_by_symbol.get(symbol, ())
+        entries = ((order_id, self.processed_orders[(symbol, order_id)]) for order_id in order_ids)
+        return [(order_id, record) for order_id, (inserted_at, record) in entries
+                if inserted_at > cutoff]
+
+    def __cleanup_processed_orders(self):
+        current_timestamp = time.monotonic()
+        with self.websocket_lock.gen_rlock():
+            if not self.processed_orders:
+                return
+            inserted_at, _ = next(iter(self.processed_orders.values()))
+            if inserted_at > current_timestamp - PROCESSED_ORDER_EXPIRATION:
+                return
+        with self.websocket_lock.gen_wlock():
+            self._expire_processed_orders(current_timestamp)
+
+    def __register_cleanup(self):
+        with AbstractDex._cleanup_thread_lock:
+            AbstractDex._instances.add(self)
+            if AbstractDex._cleanup_thread is None:
+                AbstractDex._cleanup_stop = threading.Event()
+                AbstractDex._cleanup_thread = threading.Thread(
+                    target=AbstractDex.__cleanup_loop,
+                    args=(AbstractDex._cleanup_stop,), daemon=True)
+                AbstractDex._cleanup_thread.start()
+
+    @staticmethod
+    def __cleanup_loop(stop_event, expiration_time=PROCESSED_ORDER_EXPIRATION):
+        while not stop_event.wait(expiration_time):
+            for instance in list(AbstractDex._instances):
+                # A failing sweep must not stop cleanup for every other instance
+                try:
+                    instance.__cleanup_processed_orders()
+                except Exception as e:
+                    print(f"An error occurred in cleanup_processed_orders: {e}")
+
+    def _instant_fill_price(self, side: str, price: str):
         price_float = float(price)
         if side == 'BUY':
             price_float *= (1.0 + TICK_PRICE_MULTIPLIER)
         else:
             price_float *= (1.0 - TICK_PRICE_MULTIPLIER)
-        return str(price_float)
+        return price_float
+
+    def modify_price_for_instant_fill(self, symbol: str, side: str, price: str):
+        return str(self._instant_fill_price(side, price))
+
+    def _close_concurrently(self, tasks, close_one, error_of,
+                            max_workers=CLOSE_POSITIONS_MAX_WORKERS):
+        # tasks are (symbol, ...) tuples for close_one; error_of maps a result to a message or None
+        errors = []
+        if tasks:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(tasks))) as executor:
+                futures = {executor.submit(close_one, *task): task[0] for task in tasks}
+                for future in as_completed(futures):
+                    try:
+                        error = error_of(future.result())
+                    except Exception as e:
+                        error = str(e)
+                    if error is not None:
+                        errors.append(f"{futures[future]}: {error}")
+
+        if errors:
+            return fast_jsonify({
+                'message': '; '.join(errors)
+            }, 500)
+
+        return json_response(EMPTY_BODY)
 
     def clear_filled_order(self, symbol: str, order_id: str):
-        with self.websocket_lock:
-            if symbol in list(self.processed_orders.keys()):
-                if order_id in list(self.processed_orders[symbol].keys()):
-                    del self.processed_orders[symbol][order_id]
-                    if not self.processed_orders[symbol]:
-                        del self.processed_orders[symbol]
+        key = (symbol, order_id)
+        with self.websocket_lock.gen_wlock():
+            if key in self.processed_orders:
+                self.__remove_processed_order(key)
 
     @abstractmethod
     def get_ticker(self, symbol: str):
@@ -1,10 +1,12 @@
 #!/usr/bin/env python3
 
+from decimal import Decimal, ROUND_FLOOR
 import os
 import threading
+from concurrent.futures import ThreadPoolExecutor
 
-from flask import make_response, jsonify
-from .abstract_dex import AbstractDex
+from .abstract_dex import (AbstractDex, EMPTY_BODY, ProcessedOrder, fast_jsonify,
+                           json_response, pooled_adapter, strip_hyphen)
 from apexpro.http_private_stark_key_sign import HttpPrivateStark
 from apexpro.constants import APEX_HTTP_TEST, NETWORKID_TEST, APEX_HTTP_MAIN, NETWORKID_MAIN
 from apexpro.constants import APEX_WS_MAIN, APEX_WS_TEST
@@ -12,18 +14,29 @@ from apexpro.websocket_api import WebSocket
 from apexpro.helpers.util import round_size
 import time
 from .kms_decrypt import get_decrypted_env
-import requests
 from typing import Optional
-import threading
+import orjson
+import requests
 
 SUPPORTED_TICKERS = ['BTCUSDC', 'ETHUSDC', 'SOLUSDC', 'AVAXUSDC',
-                     'ARBUSDC', 'XRPUSDC', 'MATICUSDC', 'OPUSDC', 'SOLUSDC', 'BNBUSDC']
+                     'ARBUSDC', 'XRPUSDC', 'MATICUSDC', 'OPUSDC', 'BNBUSDC']
+TICKER_INDEX = {ticker: index for index, ticker in enumerate(SUPPORTED_TICKERS)}
+ORDER_EXPIRATION_BUCKET = 60  # seconds
+TAKER_FEE_RATE_TTL = 300  # seconds
+
+# Static error bodies, encoded once at import
+ERR_UNKNOWN_PRICE = orjson.dumps({'message': 'lastPrice information is unknown'})
+ERR_MISSING_BALANCE = orjson.dumps(
+    {'message': 'Some required data is missing in the response'})
 
 
 class ApexDex(AbstractDex):
     def __init__(self, env_mode="TESTNET"):
         super().__init__()
 
+        # Last price per ticker, indexed by TICKER_INDEX
+        self._prices = [None] * len(SUPPORTED_TICKERS)
+
         suffix = "_MAIN" if env_mode == "MAINNET" else "_TEST"
         env_vars = {
             'APEX_API_KEY': get_decrypted_env(f'APEX_API_KEY{suffix}'),
@@ -70,9 +83,24 @@ class ApexDex(AbstractDex):
             stark_public_key_y_coordinate=stark_public_key_y_coordinate,
             api_key_credentials=api_key_credentials,
         )
-        self.configs = self.client.configs()
-        self.client.get_user()
-        self.client.get_account()
+        self.__configure_http_session()
+
+        # The startup REST calls are independent, so overlap their round trips
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            configs_future = executor.submit(self.client.configs)
+            user_future = executor.submit(self.client.get_user)
+            account_future = executor.submit(self.client.get_account)
+            self.configs = configs_future.result()
+            user_future.result()
+            account_future.result()
+        self._taker_fee_rate = self.client.account['takerFeeRate']
+        self._taker_fee_rate_timestamp = time.monotonic()
+        self._taker_fee_rate_lock = threading.Lock()
+        self._symbol_map = {v['symbol']: v
+                            for v in self.configs['data']['perpetualContract']}
+        for v in self._symbol_map.values():
+            v['_step_size'] = Decimal(v['stepSize'])
+            v['_tick_size'] = Decimal(v['tickSize'])
         self.apex_http = apex_http
 
         # Create WebSocket with authentication
@@ -86,6 +114,19 @@ class ApexDex(AbstractDex):
         for ticker in SUPPORTED_TICKERS:
             self.ws_client.ticker_stream(self.__on_ticker_changed, ticker)
 
+    def __configure_http_session(self):
+        # The apexpro client keeps its requests.Session in `client`; give it a larger
+        # keep-alive pool so concurrent orders reuse connections instead of handshaking
+        session = getattr(self.client, 'client', None)
+        if not isinstance(session, requests.Session):
+            return
+
+        adapter = pooled_adapter(pool_connections=20, pool_maxsize=50,
+                                 retries=3, backoff_factor=0.3)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers['Connection'] = 'keep-alive'
+
     def shutdown(self):
         super().cleanup_timer()
         self.ws_client.ws_private = None
@@ -95,16 +136,42 @@ class ApexDex(AbstractDex):
         symbol = message.get('data', {}).get('symbol')
         last_price = message.get('data', {}).get('lastPrice')
 
-        if symbol != None and last_price != None:
-            with self.websocket_lock:
-                self.price_info[symbol] = last_price
+        index = TICKER_INDEX.get(symbol)
+        if index is not None and last_price != None:
+            # A list item store is atomic under the GIL, so readers need no lock
+            self._prices[index] = last_price
+
+    def __get_taker_fee_rate(self):
+        if time.monotonic() - self._taker_fee_rate_timestamp > TAKER_FEE_RATE_TTL:
+            # Single flight: one order refreshes, concurrent orders keep the cached rate
+            if self._taker_fee_rate_lock.acquire(blocking=False):
+                try:
+                    if time.monotonic() - self._taker_fee_rate_timestamp > TAKER_FEE_RATE_TTL:
+                        self.client.get_account()
+                        self._taker_fee_rate = self.client.account['takerFeeRate']
+                        self._taker_fee_rate_timestamp = time.monotonic()
+                finally:
+                    self._taker_fee_rate_lock.release()
+        return self._taker_fee_rate
+
+    def __update_taker_fee_rate(self, contents):
+        # Account pushes carry the fee tier, which keeps the cached rate fresh without REST calls
+        for account in contents.get('accounts') or ():
+            if not isinstance(account, dict):
+                continue
+            taker_fee_rate = account.get('takerFeeRate')
+            if taker_fee_rate is not None:
+                self._taker_fee_rate = taker_fee_rate
+                self._taker_fee_rate_timestamp = time.monotonic()
 
     def __on_account_changed(self, message):
         current_orders = message['contents']['orders']
         current_timestamp = time.time()
+        current_timestamp_ms = int(current_timestamp * 1000)
 
-        threshold = 60  # secconds
+        threshold_ms = 60_000  # milliseconds
 
+        filled_orders = []
         for order in current_orders:
             status = order['status']
             if status != "FILLED":
@@ -112,47 +179,58 @@ class ApexDex(AbstractDex):
 
             order_id = order['orderId']
             symbol = order['symbol']
-            order_created_at = order['createdAt'] / 1000.0
             filled_size = order['cumSuccessFillSize']
             filled_val = order['cumSuccessFillValue']
             filled_fee = order['cumSuccessFillFee']
 
-            if current_timestamp - order_created_at < threshold:
-                with self.websocket_lock:
-                    if symbol not in self.processed_orders:
-                        self.processed_orders[symbol] = {}
-                    if order_id not in self.processed_orders[symbol]:
-                        self.processed_orders[symbol][order_id] = {
-                            "timestamp": current_timestamp,
-                            "filled_size": filled_size,
-                            "filled_value": filled_val,
-                            "filled_fee": filled_fee
-                        }
+            if current_timestamp_ms - order['createdAt'] < threshold_ms:
+                filled_orders.append((symbol, order_id, ProcessedOrder(
+                    timestamp=current_timestamp,
+                    filled_size=filled_size,
+                    filled_value=filled_val,
+                    filled_fee=filled_fee
+                )))
+
+        if filled_orders:
+            # One critical section per message, so readers never see a half-applied batch
+            with self.websocket_lock.gen_wlock():
+                for symbol, order_id, record in filled_orders:
+                    self._add_processed_order(symbol, order_id, record)
+
+        # After the fills, so an unexpected accounts payload cannot drop them
+        self.__update_taker_fee_rate(message['contents'])
+
+    def modify_price_for_instant_fill(self, symbol: str, side: str, price: str):
+        symbolData = self._symbol_map.get(symbol)
+        if symbolData is None:
+            return super().modify_price_for_instant_fill(symbol, side, price)
+
+        # Floor to the tick in Decimal, so prices far above the tick keep exact multiples
+        tick = symbolData['_tick_size']
+        steps = (Decimal(repr(self._instant_fill_price(side, price))) / tick).to_integral_value(
+            ROUND_FLOOR)
+        return format(steps * tick, 'f')
 
     def get_ticker(self, symbol: str):
-        symbol_without_hyphen = symbol.replace("-", "")
+        symbol_without_hyphen = strip_hyphen(symbol)
 
-        with self.websocket_lock:
-            data = self.price_info.copy()
+        index = TICKER_INDEX.get(symbol_without_hyphen)
+        price = self._prices[index] if index is not None else None
 
-        if symbol_without_hyphen in data:
-            return jsonify({
-                'symbol': symbol,
-                'price': data[symbol_without_hyphen]
-            })
+        if price is not None:
+            # The symbol matched a streamed ticker, so it only holds alphanumerics and
+            # hyphens and can be spliced in as is; the price keeps its JSON type
+            body = b'{"symbol":"' + symbol.encode() + b'","price":' + \
+                orjson.dumps(price) + b'}'
+            return json_response(body)
         else:
-            error_message = 'lastPrice information is unknown'
-            return make_response(jsonify({
-                'message': error_message
-            }), 503)
+            return json_response(ERR_UNKNOWN_PRICE, 503)
 
     def get_filled_orders(self, symbol: str):
-        with self.websocket_lock:
-            orders_data = self.processed_orders.get(symbol, {})
-
-        orders_list = [{"order_id": order_id, **data}
-                       for order_id, data in orders_data.items()]
-        return jsonify({"orders": orders_list})
+        with self.websocket_lock.gen_rlock():
+            orders_list = [{"order_id": order_id, **record._asdict()}
+                           for order_id, record in self._live_processed_orders(symbol)]
+        return fast_jsonify({"orders": orders_list})
 
     def get_balance(self):
         ret = self.client.get_account_balance()
@@ -162,36 +240,31 @@ class ApexDex(AbstractDex):
             data = ret['data']
 
             if all(key in data for key in required_keys):
-                return jsonify({
+                return fast_jsonify({
                     'equity': data['totalEquityValue'],
                     'balance': data['availableBalance'],
                 })
 
-        return make_response(jsonify({
-            'message': 'Some required data is missing in the response'
-        }), 500)
+        return json_response(ERR_MISSING_BALANCE, 500)
 
     def create_order(self, symbol: str, size: str, side: str, price: Optional[str]):
         try:
+            symbolData = self._symbol_map.get(symbol, {})
+
             if price is None:
                 worstPrice = self.client.get_worst_price(
                     symbol=symbol, side=side, size=size)
                 price = worstPrice['data']['worstPrice']
-                price = self.modify_price_for_instant_fill(
+                rounded_price = self.modify_price_for_instant_fill(
                     symbol, side, price)
+            else:
+                rounded_price = round_size(price, symbolData.get('_tick_size'))
 
-            currentTime = time.time()
-            limitFeeRate = self.client.account['takerFeeRate']
-
-            symbolData = {}
-            for k, v in enumerate(self.configs.get('data').get('perpetualContract')):
-                if v.get('symbol') == symbol:
-                    symbolData = v
-                    break
+            # Round up to the next bucket so orders in the same window share an expiration
+            currentTime = (int(time.time()) // ORDER_EXPIRATION_BUCKET + 1) * ORDER_EXPIRATION_BUCKET
+            limitFeeRate = self.__get_taker_fee_rate()
 
-            rounded_size = round_size(size, symbolData.get('stepSize'))
-
-            rounded_price = round_size(price, symbolData.get('tickSize'))
+            rounded_size = round_size(size, symbolData.get('_step_size'))
 
             ret = self.client.create_order(symbol=symbol, side=side,
                                            type="MARKET", size=rounded_size, price=rounded_price, limitFeeRate=limitFeeRate,
@@ -200,21 +273,21 @@ class ApexDex(AbstractDex):
             if 'code' in ret:
                 code = ret['code']
                 message = ret.get('msg', '') + f" ({code})"
-                return make_response(jsonify({
+                return fast_jsonify({
                     'message': message
-                }), 500)
+                }, 500)
 
             order_id = ret['data']['orderId']
 
-            return jsonify({
+            return fast_jsonify({
                 'order_id': order_id
             })
 
         except Exception as e:
             print(f"An error occurred in create_order: {e}")
-            return make_response(jsonify({
+            return fast_jsonify({
                 'message': str(e)
-            }), 500)
+            }, 500)
 
     def cancel_order(self, order_id):
         ret = self.client.delete_order(order_id=order_id)
@@ -222,15 +295,24 @@ class ApexDex(AbstractDex):
         if 'code' in ret:
             code = ret['code']
             message = ret.get('msg', '') + f" ({code})"
-            return make_response(jsonify({
+            return fast_jsonify({
                 'message': message
-            }), 500)
+            }, 500)
+
+        return json_response(EMPTY_BODY)
+
+    def __close_one(self, symbol, size, opposite_order_side):
+        return self.create_order(symbol, size, opposite_order_side, None)
 
-        return jsonify({})
+    @staticmethod
+    def __close_error(response):
+        if response.status_code == 200:
+            return None
+        return orjson.loads(response.get_data()).get('message', '')
 
     def close_all_positions(self, close_symbol):
         account_data = self.client.get_account()
-        position_sizes = {}
+        tasks = []
 
         for position in account_data['data']['openPositions']:
             symbol = position['symbol']
@@ -238,25 +320,12 @@ class ApexDex(AbstractDex):
             size_str = position['size']
             size_float = float(position['size'])
 
-            if size_float != 0:
-                key = f"{symbol}_{side}"
-                position_sizes[key] = size_str
-
-        try:
-            for key, size in position_sizes.items():
-                symbol, side = key.split('_')
-                if close_symbol is None or symbol == close_symbol:
-                    opposite_order_side = 'SELL' if side == 'LONG' else 'BUY'
-                else:
-                    continue
-
-                self.create_order(symbol, size, opposite_order_side, None)
+            if size_float == 0:
+                continue
+            if close_symbol is not None and symbol != close_symbol:
+                continue
 
-            return jsonify({
-            })
+            opposite_order_side = 'SELL' if side == 'LONG' else 'BUY'
+            tasks.append((symbol, size_str, opposite_order_side))
 
-        except Exception as e:
-            print(f"An error occurred in close_all_positions: {e}")
-            return make_response(jsonify({
-                'message': str(e)
-            }), 500)
+        return self._close_concurrently(tasks, self.__close_one, self.__close_error)
@@ -1,54 +1,66 @@
 #!/usr/bin/env python3
 
 import boto3
+import functools
 import os
 import base64
+from cryptography.hazmat.primitives import padding
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.backends import default_backend
 
 
-def unpad_pkcs7(data):
-    """
-    Remove the PKCS#7 padding from the provided data.
-    """
-    if not data:
-        return data
+_KMS = None
 
-    pad_len = data[-1]
-    return data[:-pad_len]
 
+def _kms():
+    """
+    Return the process-wide KMS client, creating it on first use.
+    """
+    global _KMS
+    if _KMS is None:
+        # AWS Region
+        region_name = os.environ.get("AWS_REGION", "eu-central-1")
+        _KMS = boto3.client('kms', region_name=region_name)
+    return _KMS
 
-def decrypt_data_with_kms(encrypted_data_key_str, encrypted_data_str, is_hex=False):
-    # AWS Region
-    region_name = os.environ.get("AWS_REGION", "eu-central-1")
-
-    # Create KMS client
-    client = boto3.client('kms', region_name=region_name)
 
+@functools.lru_cache(maxsize=8)
+def _decrypt_data_key(encrypted_data_key_str):
+    """
+    Decrypt the data key with KMS. Every secret shares the same data key,
+    so KMS is only called once per key.
+    """
     # Decode the provided encrypted data key
     if not encrypted_data_key_str:
         raise ValueError("Specify your encrypted data key")
     encrypted_data_key = base64.b64decode(
         encrypted_data_key_str.replace(" ", ""))
 
+    # Decrypt the data key using KMS
+    response = _kms().decrypt(CiphertextBlob=encrypted_data_key)
+    return response["Plaintext"]
+
+
+@functools.lru_cache(maxsize=64)
+def decrypt_data_with_kms(encrypted_data_key_str, encrypted_data_str, is_hex=False):
+    decrypted_data_key = _decrypt_data_key(encrypted_data_key_str)
+
     # Decode the provided encrypted data
     if not encrypted_data_str:
         raise ValueError("Specify your encrypted data")
     encrypted_data = base64.b64decode(encrypted_data_str.replace(" ", ""))
 
-    # Decrypt the data key using KMS
-    response = client.decrypt(CiphertextBlob=encrypted_data_key)
-    decrypted_data_key = response["Plaintext"]
-
     # Decrypt the actual data using the decrypted data key
+    encrypted_view = memoryview(encrypted_data)
     cipher = Cipher(algorithms.AES(decrypted_data_key), modes.CBC(
-        encrypted_data[:16]), backend=default_backend())
+        encrypted_view[:16]), backend=default_backend())
     decryptor = cipher.decryptor()
     decrypted_data = decryptor.update(
-        encrypted_data[16:]) + decryptor.finalize()
+        encrypted_view[16:]) + decryptor.finalize()
 
-    # Remove the padding from the decrypted data
-    unpadded_data = unpad_pkcs7(decrypted_data)
+    # Remove and validate the PKCS#7 padding (raises ValueError if it is malformed)
+    unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
+    unpadded_data = unpadder.update(decrypted_data) + unpadder.finalize()
 
     # If the data is supposed to be in hex, convert it to a hex string
     if is_hex:
@@ -3,12 +3,14 @@
 import decimal
 import hashlib
 import hmac
-import json
+import math
+import operator
 import os
+import threading
 
-from flask import make_response, jsonify
-import urllib.parse
-from .abstract_dex import AbstractDex
+import orjson
+from .abstract_dex import (AbstractDex, EMPTY_BODY, fast_jsonify, json_response,
+                           pooled_adapter, step_decimals, strip_hyphen)
 import time
 from .kms_decrypt import get_decrypted_env
 import requests
@@ -16,20 +18,45 @@ from typing import Optional
 
 MUFEX_HTTP_MAIN = "https://api.mufex.finance"
 MUFEX_HTTP_TEST = "https://api.testnet.mufex.finance"
+TICKER_CACHE_TTL = 0.5  # seconds
+REQUEST_TIMEOUT = (0.2, 0.8)  # (connect, read) seconds
+RECV_WINDOW = '5000'  # milliseconds, kept as the header string
+POSITION_FIELDS = operator.itemgetter('symbol', 'size', 'side')
+FILLED_ORDER_FIELDS = ('cumExecQty', 'cumExecValue', 'cumExecFee')
+
+
+def round_size(size, ticker_size, decimals, use_decimal=False):
+    if use_decimal:
+        sizeNumber = decimal.Decimal(size) / decimal.Decimal(ticker_size)
+        return str(decimal.Decimal(int(sizeNumber)) * decimal.Decimal(ticker_size))
+
+    step = float(ticker_size)
+    quotient = float(size) / step
+    # Snap exact multiples that float error put just below a step, such as
+    # 0.3 / 0.1 == 2.9999999999999996; the error grows with the quotient, so scale the bound
+    nearest = round(quotient)
+    if abs(quotient - nearest) <= max(1e-9, abs(quotient) * 4e-15):
+        steps = nearest
+    else:
+        steps = math.floor(quotient)
+    return f"{steps * step:.{decimals}f}"
 
 
-def round_size(size, ticker_size):
-    sizeNumber = decimal.Decimal(size) / decimal.Decimal(ticker_size)
-    return decimal.Decimal(int(sizeNumber)) * decimal.Decimal(ticker_size)
+SIDE_MAP = {
+    ('BUY', False): 'Buy',
+    ('BUY', True): 'Sell',
+    ('SELL', False): 'Sell',
+    ('SELL', True): 'Buy',
+}
 
 
 def convert_side(side, reverse=False):
-    side = side.upper()
-    side_map = {'BUY': 'Sell', 'SELL': 'Buy'}
-    if side in side_map:
-        return side_map[side] if reverse else side.capitalize()
-    else:
-        return 'Invalid Side'
+    return SIDE_MAP.get((side.upper(), bool(reverse)), 'Invalid Side')
+
+
+def build_query_string(params):
+    # Symbols and order ids are URL-safe, so values are not percent-encoded
+    return '&'.join(f"{k}={v}" for k, v in sorted(params.items()))
 
 
 class ApiResponse:
@@ -59,35 +86,64 @@ class MufexDex(AbstractDex):
 
         self.api_key = env_vars['MUFEX_API_KEY']
         self.api_secret = env_vars['MUFEX_API_SECRET']
+        # Keyed once; each signature copies it instead of redoing the key schedule
+        self._hmac_template = hmac.new(self.api_secret.encode(), digestmod=hashlib.sha256)
+        self._key_recv_window = f"{self.api_key}{RECV_WINDOW}".encode()
 
         if env_mode == "MAINNET":
             self.mufex_http = MUFEX_HTTP_MAIN
         else:
             self.mufex_http = MUFEX_HTTP_TEST
 
+        self._url_instruments = f"{self.mufex_http}/public/v1/instruments"
+        self._url_tickers = f"{self.mufex_http}/public/v1/market/tickers"
+        self._url_create_order = f"{self.mufex_http}/private/v1/trade/create"
+        self._url_activity_orders = f"{self.mufex_http}/private/v1/trade/activity-orders"
+        self._url_balance = f"{self.mufex_http}/private/v1/account/balance"
+        self._url_positions = f"{self.mufex_http}/private/v1/account/positions"
+
+        # Keep-alive pool so REST calls reuse the TLS connection
+        self.session = requests.Session()
+        self.session.mount('https://', pooled_adapter(
+            pool_connections=8, pool_maxsize=16, retries=2, backoff_factor=0.1))
+        # Static headers live on the session; requests only pass the signature fields
+        self.session.headers.update({
+            'Content-Type': 'application/json',
+            'MF-ACCESS-SIGN-TYPE': '2',
+            'MF-ACCESS-API-KEY': self.api_key,
+        })
+
+        self._ticker_cache = {}  # {'symbol': (timestamp, price), ...}
+        self._ticker_cache_lock = threading.Lock()
+        self._qty_step = {}  # {'symbol': (qty_step, decimals), ...}
+        self._qty_step_lock = threading.Lock()
+
     def shutdown(self):
-        pass
+        super().cleanup_timer()
+        self.session.close()
 
-    def __send_get_request(self, endpoint, params=None, headers=None):
-        request_url = f"{self.mufex_http}{endpoint}"
+    def __send_get_request(self, request_url, params=None, headers=None, query_string=None):
+        if query_string:
+            # Send the exact query string that was signed
+            request_url = f"{request_url}?{query_string}"
         try:
-            response = requests.get(
-                request_url, params=params, headers=headers, timeout=1)
+            response = self.session.get(
+                request_url, params=params, headers=headers, timeout=REQUEST_TIMEOUT)
             response.raise_for_status()
-            return ApiResponse(data=response.json())
+            return ApiResponse(data=orjson.loads(response.content))
         except requests.exceptions.Timeout:
             return ApiResponse(error=f"Request timed out: url={request_url}")
         except Exception as e:
             self.__handle_request_error(e)
             return ApiResponse(error=str(e))
 
-    def __send_post_request(self, endpoint, json_body, headers):
-        request_url = f"{self.mufex_http}{endpoint}"
+    def __send_post_request(self, request_url, body: bytes, headers):
+        # body is the exact JSON that was signed; Content-Type is set on the session
         try:
-            response = requests.post(
-                request_url, json=json_body, headers=headers, timeout=1)
+            response = self.session.post(
+                request_url, data=body, headers=headers, timeout=REQUEST_TIMEOUT)
             response.raise_for_status()
-            return ApiResponse(data=response.json())
+            return ApiResponse(data=orjson.loads(response.content))
         except requests.exceptions.Timeout:
             return ApiResponse(error=f"Request timed out: url={request_url}")
         except Exception as e:
@@ -96,54 +152,78 @@ class MufexDex(AbstractDex):
 
     def __handle_request_error(self, e):
         print(f"Unexpected error: {e}")
-        response_content = e.response.text if e.response else 'No content'
-        status_code = e.response.status_code if e.response else 'No status code'
+        # Only requests exceptions carry a response; orjson decode errors do not
+        response = getattr(e, 'response', None)
+        response_content = response.text if response is not None else 'No content'
+        status_code = response.status_code if response is not None else 'No status code'
         print(f"HTTP Response Content: {response_content}")
         print(f"HTTP Status Code: {status_code}")
 
-    def __generate_signature(self, query_string='', json_body_string='', recv_window=5000):
-        timestamp = int(time.time() * 1000)
-        prehash = f"{timestamp}{self.api_key}{recv_window}{query_string}{json_body_string}"
-        signature = hmac.new(self.api_secret.encode(),
-                             prehash.encode(), hashlib.sha256).hexdigest()
-        return signature, timestamp, recv_window
+    def __generate_signature(self, query_string='', body: bytes = b''):
+        # The timestamp is formatted once and reused for the prehash and the header
+        timestamp = str(time.time_ns() // 1_000_000)
+        mac = self._hmac_template.copy()
+        mac.update(timestamp.encode())
+        mac.update(self._key_recv_window)
+        if query_string:
+            mac.update(query_string.encode())
+        if body:
+            # Signed as the exact bytes that are sent
+            mac.update(body)
+        return mac.hexdigest(), timestamp
+
+    def __build_headers(self, signature, timestamp):
+        # Content-Type, sign type and API key are set on the session
+        return {
+            'MF-ACCESS-SIGN': signature,
+            'MF-ACCESS-TIMESTAMP': timestamp,
+            'MF-ACCESS-RECV-WINDOW': RECV_WINDOW,
+        }
 
-    def __create_order_internal(self, symbol: str, size: str, side: str, price: Optional[str], reverse=False):
-        symbol_without_hyphen = symbol.replace("-", "")
-        endpoint = "/public/v1/instruments"
+    def __get_qty_step(self, symbol_without_hyphen):
+        # The lot size of an instrument is static, so fetch it once per symbol
+        with self._qty_step_lock:
+            qty_step = self._qty_step.get(symbol_without_hyphen)
+        if qty_step is not None:
+            return qty_step
+
+        request_url = self._url_instruments
         params = {'category': 'linear', 'symbol': symbol_without_hyphen}
 
-        response = self.__send_get_request(endpoint, params)
+        response = self.__send_get_request(request_url, params)
         if response.is_error():
             return response
 
         data = response.data
 
         qty_step = data["data"]["list"][0]["lotSizeFilter"]["qtyStep"]
-        rounded_size = round_size(size, qty_step)
+        qty_step = (qty_step, step_decimals(qty_step))
+        with self._qty_step_lock:
+            self._qty_step[symbol_without_hyphen] = qty_step
+        return qty_step
+
+    def __create_order_internal(self, symbol: str, size: str, side: str, price: Optional[str], reverse=False):
+        symbol_without_hyphen = strip_hyphen(symbol)
+
+        qty_step = self.__get_qty_step(symbol_without_hyphen)
+        if isinstance(qty_step, ApiResponse):
+            return qty_step
+
+        rounded_size = round_size(size, *qty_step)
         side = convert_side(side, reverse)
 
         json_body = {
             'symbol': symbol_without_hyphen, 'side': side, 'positionIdx': 0,
-            'orderType': 'Market', 'qty': str(rounded_size), 'timeInForce': 'ImmediateOrCancel'
+            'orderType': 'Market', 'qty': rounded_size, 'timeInForce': 'ImmediateOrCancel'
         }
-        json_body_string = json.dumps(json_body)
+        body = orjson.dumps(json_body)
 
-        signature, timestamp, recv_window = self.__generate_signature(
-            json_body_string=json_body_string)
+        signature, timestamp = self.__generate_signature(body=body)
 
-        headers = {
-            'MF-ACCESS-SIGN-TYPE': '2',
-            'MF-ACCESS-SIGN': signature,
-            'MF-ACCESS-API-KEY': self.api_key,
-            'MF-ACCESS-TIMESTAMP': str(timestamp),
-            'MF-ACCESS-RECV-WINDOW': str(recv_window),
-            'Content-Type': 'application/json'
-        }
+        headers = self.__build_headers(signature, timestamp)
 
-        endpoint = "/private/v1/trade/create"
-        response = self.__send_post_request(
-            endpoint, json_body, headers)
+        request_url = self._url_create_order
+        response = self.__send_post_request(request_url, body, headers)
         if response.is_error():
             return response
 
@@ -153,22 +233,23 @@ class MufexDex(AbstractDex):
             message = data.get('message', '') + f" ({code})"
             return ApiResponse(error=message)
 
-        id = data['data']['orderId']
-        endpoint = "/private/v1/trade/activity-orders"
-        params = {'orderId': id, 'symbol': symbol_without_hyphen}
-        signature, timestamp, recv_window = self.__generate_signature(
-            urllib.parse.urlencode(params))
+        # Skip the follow-up query when the create response already carries the fill
+        order = data['data']
+        if order.get('orderStatus') == 'Filled' and all(
+                field in order for field in FILLED_ORDER_FIELDS):
+            return ApiResponse(data={'data': {'list': [order]}})
 
-        headers = {
-            'MF-ACCESS-SIGN-TYPE': '2',
-            'MF-ACCESS-SIGN': signature,
-            'MF-ACCESS-API-KEY': self.api_key,
-            'MF-ACCESS-TIMESTAMP': str(timestamp),
-            'MF-ACCESS-RECV-WINDOW': str(recv_window)
-        }
+        id = order['orderId']
+        request_url = self._url_activity_orders
+        query_string = build_query_string(
+            {'orderId': id, 'symbol': symbol_without_hyphen})
+        signature, timestamp = self.__generate_signature(
+            query_string)
+
+        headers = self.__build_headers(signature, timestamp)
 
         response = self.__send_get_request(
-            endpoint, params=params, headers=headers)
+            request_url, headers=headers, query_string=query_string)
         if response.is_error():
             return response
 
@@ -181,26 +262,16 @@ class MufexDex(AbstractDex):
         return response
 
     def __get_positions(self, symbol):
-        endpoint = "/private/v1/account/positions"
-        params = {}
+        request_url = self._url_positions
+        # The only parameter is the optional symbol, so format it directly
+        query_string = f"symbol={strip_hyphen(symbol)}" if symbol is not None else ''
+        signature, timestamp = self.__generate_signature(
+            query_string)
 
-        if symbol is not None:
-            symbol_without_hyphen = symbol.replace("-", "")
-            params['symbol'] = symbol_without_hyphen
-
-        signature, timestamp, recv_window = self.__generate_signature(
-            urllib.parse.urlencode(params))
-
-        headers = {
-            'MF-ACCESS-SIGN-TYPE': '2',
-            'MF-ACCESS-SIGN': signature,
-            'MF-ACCESS-API-KEY': self.api_key,
-            'MF-ACCESS-TIMESTAMP': str(timestamp),
-            'MF-ACCESS-RECV-WINDOW': str(recv_window)
-        }
+        headers = self.__build_headers(signature, timestamp)
 
         response = self.__send_get_request(
-            endpoint, params=params, headers=headers)
+            request_url, headers=headers, query_string=query_string)
         if response.is_error():
             return response
 
@@ -211,35 +282,37 @@ class MufexDex(AbstractDex):
             message = data.get('message', '') + f"({code})"
             return ApiResponse(error=message)
 
-        positions = data['data']["list"]
-        extracted_positions = []
-
-        for position in positions:
-            extracted_position = {
-                "symbol": position["symbol"],
-                "size": position["size"],
-                "side": position["side"]
-            }
-            extracted_positions.append(extracted_position)
-
-        return ApiResponse(data=extracted_positions)
+        # [(symbol, size, side), ...]; the other position fields are unused
+        return ApiResponse(data=list(map(POSITION_FIELDS, data['data']["list"])))
 
     def get_ticker(self, symbol: str):
-        endpoint = "/public/v1/market/tickers"
-        symbol_without_hyphen = symbol.replace("-", "")
+        current_timestamp = time.monotonic()
+        with self._ticker_cache_lock:
+            cached = self._ticker_cache.get(symbol)
+        if cached is not None and current_timestamp - cached[0] < TICKER_CACHE_TTL:
+            return fast_jsonify({
+                'symbol': symbol,
+                'price': cached[1]
+            })
+
+        request_url = self._url_tickers
+        symbol_without_hyphen = strip_hyphen(symbol)
         params = {'symbol': symbol_without_hyphen}
 
-        response = self.__send_get_request(endpoint, params)
+        response = self.__send_get_request(request_url, params)
         if response.is_error():
-            return make_response(jsonify({
+            return fast_jsonify({
                 'message': response.error
-            }), 500)
+            }, 500)
 
         data = response.data
 
         price = data["data"]["list"][0]["lastPrice"]
 
-        return jsonify({
+        with self._ticker_cache_lock:
+            self._ticker_cache[symbol] = (current_timestamp, price)
+
+        return fast_jsonify({
             'symbol': symbol,
             'price': price
         })
@@ -248,82 +321,66 @@ class MufexDex(AbstractDex):
         raise Exception("Not implemented")
 
     def get_balance(self):
-        endpoint = "/private/v1/account/balance"
-        signature, timestamp, recv_window = self.__generate_signature()
+        request_url = self._url_balance
+        signature, timestamp = self.__generate_signature()
 
-        headers = {
-            'MF-ACCESS-SIGN-TYPE': '2',
-            'MF-ACCESS-SIGN': signature,
-            'MF-ACCESS-API-KEY': self.api_key,
-            'MF-ACCESS-TIMESTAMP': str(timestamp),
-            'MF-ACCESS-RECV-WINDOW': str(recv_window),
-            'Content-Type': 'application/json'
-        }
+        headers = self.__build_headers(signature, timestamp)
 
-        response = self.__send_get_request(endpoint, headers=headers)
+        response = self.__send_get_request(request_url, headers=headers)
         if response.is_error():
-            return make_response(jsonify({'message': response.error}), 500)
+            return fast_jsonify({'message': response.error}, 500)
 
         data = response.data
 
         code = data.get('code', 9999)
         if code != 0:
             message = data.get('message', '') + f" ({code})"
-            return make_response(jsonify({'message': message}), 500)
+            return fast_jsonify({'message': message}, 500)
 
-        equity = data["data"]["list"][0]["equity"]
-        balance = data["data"]["list"][0]["walletBalance"]
+        account = data["data"]["list"][0]
 
-        return jsonify({
-            'equity': equity,
-            'balance': balance
+        return fast_jsonify({
+            'equity': account["equity"],
+            'balance': account["walletBalance"]
         })
 
     def create_order(self, symbol: str, size: str, side: str, price: Optional[str]):
         response = self.__create_order_internal(symbol, size, side, price)
         if response.is_error():
-            return make_response(jsonify({
+            return fast_jsonify({
                 'message': response.error
-            }), 500)
+            }, 500)
         else:
             data = response.data
 
-            if data["data"]["list"][0]["orderStatus"] == 'Filled':
-                size = data["data"]["list"][0]["cumExecQty"]
-                val = data["data"]["list"][0]["cumExecValue"]
-                fee = data["data"]["list"][0]["cumExecFee"]
+            order = data["data"]["list"][0]
+            if order["orderStatus"] == 'Filled':
+                size = order["cumExecQty"]
+                val = order["cumExecValue"]
+                fee = order["cumExecFee"]
                 price_float = float(val) / float(size)
                 price = str(price_float)
 
-                return jsonify({
+                return fast_jsonify({
                     'price': price,
                     'size': size,
                     'fee': fee,
                 })
             else:
-                return jsonify({})
+                return json_response(EMPTY_BODY)
 
     def cancel_order(self, order_id):
         raise Exception("Not implemented")
 
+    def __close_one(self, symbol, size, side):
+        return self.__create_order_internal(symbol, size, side, None, True)
+
     def close_all_positions(self, close_symbol):
         response = self.__get_positions(close_symbol)
         if response.is_error():
-            return make_response(jsonify({
+            return fast_jsonify({
                 'message': response.error
-            }), 500)
-
-        positions = response.data
-
-        for position in positions:
-            size_float = float(position['size'])
-            if size_float == 0.0:
-                continue
-            response = self.__create_order_internal(
-                position['symbol'], position['size'], position['side'], None, True)
-            if response.is_error():
-                return make_response(jsonify({
-                    'message': response.error
-                }), 500)
-
-        return jsonify({})
+            }, 500)
+
+        tasks = [position for position in response.data if float(position[1]) != 0.0]
+        return self._close_concurrently(tasks, self.__close_one, ApiResponse.is_error)
@@ -2,11 +2,13 @@
 
 import os
 import hashlib
-from flask import Flask, request, jsonify
-from dex.apex import ApexDex
-from dex.mufex import MufexDex
+import hmac
+from flask import Flask, g, request
+from dex.abstract_dex import EMPTY_BODY, json_response
 from dex.kms_decrypt import get_decrypted_env
 import logging
+import operator
+import orjson
 import signal
 
 app = Flask(__name__)
@@ -17,21 +19,38 @@ log.setLevel(logging.WARNING)
 
 env_mode = os.environ.get("ENV_MODE", "TESTNET").upper()
 
-supported_dex_names = os.environ.get(
-    "SUPPORTED_DEX", "apex,mufex").lower().split(',')
+# Tolerate spaces and empty entries such as "apex, mufex,"
+supported_dex_names = frozenset(
+    name.strip().lower() for name in os.environ.get("SUPPORTED_DEX", "apex,mufex").split(',')
+    if name.strip())
 
-dex_classes = {
-    'apex': ApexDex,
-    # 'mufex': MufexDex
-}
+# Import only the DEX modules that are enabled, so unused SDKs are never loaded
+dex_classes = {}
+if 'apex' in supported_dex_names:
+    from dex.apex import ApexDex
+    dex_classes['apex'] = ApexDex
+# if 'mufex' in supported_dex_names:
+#     from dex.mufex import MufexDex
+#     dex_classes['mufex'] = MufexDex
 
 dex_instances = {dex_name: dex_classes[dex_name](
     env_mode) for dex_name in supported_dex_names if dex_name in dex_classes}
 
+if not dex_instances:
+    raise EnvironmentError(
+        f"No supported DEX is enabled: SUPPORTED_DEX={', '.join(sorted(supported_dex_names))}")
+
 DEX_ROUTER_API_KEY = get_decrypted_env('DEX_ROUTER_API_KEY')
+# Clients send the SHA-256 hex digest of the key; hash it once at startup
+EXPECTED_API_KEY_DIGEST = (hashlib.sha256(DEX_ROUTER_API_KEY.encode()).digest()
+                           if DEX_ROUTER_API_KEY is not None else None)
+API_KEY_HEX_LENGTH = hashlib.sha256().digest_size * 2
 
 def signal_handler(signum, frame):
     global shutdown_requested
+    # Tear the DEX instances down once, even if SIGTERM is delivered again
+    if shutdown_requested:
+        return
     shutdown_requested = True
     for dex_instance in dex_instances.values():
         dex_instance.shutdown()
@@ -39,33 +58,62 @@ def signal_handler(signum, frame):
 
 signal.signal(signal.SIGTERM, signal_handler)
 
-def get_dex(request):
-    dex_name = request.args.get('dex')
-    return dex_instances.get(dex_name)
+# Router rejections, in the exact wording clients already match on
+ERR_SHUTTING_DOWN = orjson.dumps({'message': 'Server is shutting down'})
+ERR_API_KEY_MISSING = orjson.dumps({'message': 'API key missing'})
+ERR_INVALID_API_KEY = orjson.dumps({'message': 'Invalid API key'})
+ERR_DEX_MISSING = orjson.dumps({'message': 'DEX missing'})
+ERR_UNSUPPORTED_DEX = orjson.dumps({'message': 'Unsupported DEX'})
+# GET routes say "parameter", /close-all-positions says "parameters"; both are the
+# original messages, so keep them distinct
+ERR_MISSING_SYMBOL = orjson.dumps({'message': 'Missing required parameter: symbol.'})
+ERR_MISSING_CLEAR_PARAMS = orjson.dumps(
+    {'message': 'Missing required parameters: symbol or order_id.'})
+ERR_MISSING_ORDER_PARAMS = orjson.dumps(
+    {'message': 'Missing required parameters: symbol, size, and/or side.'})
+ERR_MISSING_ORDER_ID = orjson.dumps({'message': 'Missing required parameters: order_id.'})
+ERR_MISSING_CLOSE_SYMBOL = orjson.dumps({'message': 'Missing required parameters: symbol.'})
+
+MISSING = object()
+# Required POST fields, extracted in one call; a missing field raises KeyError
+CLEAR_ORDER_FIELDS = operator.itemgetter('symbol', 'order_id')
+CREATE_ORDER_FIELDS = operator.itemgetter('symbol', 'size', 'side')
+
+def get_json_body():
+    # Parse with orjson; an empty or malformed body is treated as having no parameters
+    try:
+        data = orjson.loads(request.get_data())
+    except orjson.JSONDecodeError:
+        return {}
+    return data if isinstance(data, dict) else {}
 
 @app.before_request
-def check_shutdown():
+def preflight():
+    # Shutdown, API key and DEX checks in one hook; the resolved DEX is kept on g
     if shutdown_requested:
-        return jsonify({"message": "Server is shutting down"}), 503
+        return json_response(ERR_SHUTTING_DOWN, 503)
 
-@app.before_request
-def check_api_key():
     api_key = request.headers.get('Authorization')
     if api_key is None:
-        return jsonify({"message": "API key missing"}), 401
-
-    expected_hash = hashlib.sha256(DEX_ROUTER_API_KEY.encode()).hexdigest()
-    if api_key != expected_hash:
-        return jsonify({"message": "Invalid API key"}), 401
+        return json_response(ERR_API_KEY_MISSING, 401)
+
+    # A hex digest has a fixed, public length, so reject other lengths before decoding
+    if EXPECTED_API_KEY_DIGEST is None or len(api_key) != API_KEY_HEX_LENGTH:
+        return json_response(ERR_INVALID_API_KEY, 401)
+    try:
+        provided_digest = bytes.fromhex(api_key)
+    except ValueError:
+        return json_response(ERR_INVALID_API_KEY, 401)
+    if not hmac.compare_digest(provided_digest, EXPECTED_API_KEY_DIGEST):
+        return json_response(ERR_INVALID_API_KEY, 401)
 
-@app.before_request
-def check_dex():
-    # Get the DEX name from the request arguments
     dex_name = request.args.get('dex')
     if not dex_name:
-        return jsonify({"message": "DEX missing"}), 400
-    elif dex_name not in supported_dex_names:
-        return jsonify({"message": "Unsupported DEX"}), 400
+        return json_response(ERR_DEX_MISSING, 400)
+
+    g.dex = dex_instances.get(dex_name)
+    if g.dex is None:
+        return json_response(ERR_UNSUPPORTED_DEX, 400)
 
 # GET /ticker
 @app.route('/ticker', methods=['GET'])
@@ -73,12 +121,9 @@ def get_ticker():
     symbol = request.args.get('symbol')
 
     if symbol is None:
-        return jsonify({
-            'message': 'Missing required parameter: symbol.'
-        }), 400
+        return json_response(ERR_MISSING_SYMBOL, 400)
 
-    dex = get_dex(request)
-    return dex.get_ticker(symbol)
+    return g.dex.get_ticker(symbol)
 
 # GET /get-filled-orders
 @app.route('/get-filled-orders', methods=['GET'])
@@ -86,83 +131,58 @@ def get_filled_orders():
     symbol = request.args.get('symbol')
 
     if symbol is None:
-        return jsonify({
-            'message': 'Missing required parameter: symbol.'
-        }), 400
+        return json_response(ERR_MISSING_SYMBOL, 400)
 
-    dex = get_dex(request)
-    return dex.get_filled_orders(symbol)
+    return g.dex.get_filled_orders(symbol)
 
 # GET /get-balance
 @app.route('/get-balance', methods=['GET'])
 def get_balance():
-    dex = get_dex(request)
-    return dex.get_balance()
+    return g.dex.get_balance()
 
 # POST /clear-filled-order
 @app.route('/clear-filled-order', methods=['POST'])
 def clear_filled_order():
-    data = request.json
-
-    if 'symbol' not in data or 'order_id' not in data:
-        return jsonify({
-            'message': 'Missing required parameters: symbol or order_id.'
-        }), 400
-
-    symbol = data.get('symbol')
-    order_id = data.get('order_id')
+    try:
+        symbol, order_id = CLEAR_ORDER_FIELDS(get_json_body())
+    except KeyError:
+        return json_response(ERR_MISSING_CLEAR_PARAMS, 400)
 
-    dex = get_dex(request)
-    dex.clear_filled_order(symbol, order_id)
-    return jsonify({})
+    g.dex.clear_filled_order(symbol, order_id)
+    return json_response(EMPTY_BODY)
 
 # POST /create-order
 @app.route('/create-order', methods=['POST'])
 def create_order():
-    data = request.json
+    data = get_json_body()
+    try:
+        symbol, size, side = CREATE_ORDER_FIELDS(data)
+    except KeyError:
+        return json_response(ERR_MISSING_ORDER_PARAMS, 400)
 
-    if 'symbol' not in data or 'size' not in data or 'side' not in data:
-        return jsonify({
-            'message': 'Missing required parameters: symbol, size, and/or side.'
-        }), 400
-
-    symbol = data.get('symbol')
-    size = data.get('size')
-    side = data.get('side')
     price = data.get('price')
 
-    dex = get_dex(request)
-    return dex.create_order(symbol, size, side, price)
+    return g.dex.create_order(symbol, size, side, price)
 
 # POST /cancel-order
 @app.route('/cancel-order', methods=['POST'])
 def cancel_order():
-    data = request.json
-
-    if 'order_id' not in data:
-        return jsonify({
-            'message': 'Missing required parameters: order_id.'
-        }), 400
+    order_id = get_json_body().get('order_id', MISSING)
 
-    order_id = data.get('order_id')
+    if order_id is MISSING:
+        return json_response(ERR_MISSING_ORDER_ID, 400)
 
-    dex = get_dex(request)
-    return dex.cancel_order(order_id)
+    return g.dex.cancel_order(order_id)
 
 # POST /close-all-positions
 @app.route('/close-all-positions', methods=['POST'])
 def close_all_positions():
-    data = request.json
-
-    if 'symbol' not in data:
-        return jsonify({
-            'message': 'Missing required parameters: symbol.'
-        }), 400
+    symbol = get_json_body().get('symbol', MISSING)
 
-    symbol = data.get('symbol')
+    if symbol is MISSING:
+        return json_response(ERR_MISSING_CLOSE_SYMBOL, 400)
 
-    dex = get_dex(request)
-    return dex.close_all_positions(symbol)
+    return g.dex.close_all_positions(symbol)
 
 
 if __name__ == '__main__':